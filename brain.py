@@ -2,13 +2,204 @@ import os
 import asyncio
 import random
 import re
-from typing import List, Optional, Tuple, Any
-from openai import OpenAI
+import json
+import time
+import hashlib
+from collections import OrderedDict
+from contextlib import aclosing
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Any
+import numpy as np
+import tiktoken
+from openai import AsyncOpenAI, RateLimitError
 import google.generativeai as genai
+from google.api_core.exceptions import ResourceExhausted
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Strips reasoning blocks some models leak into their output
+_THINK_RE = re.compile(r'<(think|thought)>.*?</\1>', re.DOTALL | re.IGNORECASE)
+_THINK_OPEN_RE = re.compile(r'<(think|thought)>', re.IGNORECASE)
+# Trailing punctuation ignored when comparing slang words
+_PUNCT_STRIP = str.maketrans('', '', '.,!?')
+
+OPENROUTER_MODEL = "xiaomi/mimo-v2-flash:free"
+GEMINI_MODEL = "gemini-1.5-flash"
+
+# Prompt size cap for the reply history (oldest messages are dropped first)
+HISTORY_TOKEN_BUDGET = 800
+TOKENIZER_LOAD_TIMEOUT = 10.0
+TOKENIZER_RETRY_DELAY = 300
+
+# Response cache tuning (proactive messages run hotter and are never cached)
+RESPONSE_CACHE_SIZE = 512
+RESPONSE_CACHE_TTL = 300
+RESPONSE_CACHE_MAX_TEMPERATURE = 0.7
+
+# Client-side throttle for provider calls (burst capacity per period, max in flight)
+THROTTLE_CAPACITY = 8
+THROTTLE_PERIOD = 1.0
+THROTTLE_CONCURRENCY = 4
+RATE_LIMIT_RETRIES = 3
+RATE_LIMIT_BACKOFF = 1.0
+
+# Semantic cache tuning (opt-in via SEMANTIC_CACHE=true)
+OPENROUTER_EMBEDDING_MODEL = "openai/text-embedding-3-small"
+GEMINI_EMBEDDING_MODEL = "models/text-embedding-004"
+SEMANTIC_CACHE_THRESHOLD = 0.93
+SEMANTIC_CACHE_TTL = 600
+SEMANTIC_CACHE_SIZE = 256
+SEMANTIC_CACHE_MAX_SCOPES = 64
+SEMANTIC_CACHE_WINDOW = 5
+
+class Throttle:
+    """
+    Async token bucket combined with a concurrency cap, used around provider calls
+    so chat bursts are smoothed out locally instead of bouncing off remote 429s.
+    """
+    def __init__(self, capacity: int = THROTTLE_CAPACITY, concurrency: int = THROTTLE_CONCURRENCY, period: float = THROTTLE_PERIOD):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._bucket_lock = asyncio.Lock()
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def _take_token(self):
+        """Waits until the bucket has a token and consumes it."""
+        async with self._bucket_lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    async def __aenter__(self):
+        await self._semaphore.acquire()
+        try:
+            await self._take_token()
+        except BaseException:
+            self._semaphore.release()
+            raise
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._semaphore.release()
+
+def _is_rate_limited(error: Exception) -> bool:
+    """True for provider errors that signal a 429 / quota exhaustion."""
+    return isinstance(error, (RateLimitError, ResourceExhausted))
+
+def _backoff_delay(attempt: int) -> float:
+    """Exponential backoff with jitter so retries from several channels don't line up."""
+    return RATE_LIMIT_BACKOFF * (2 ** attempt) + random.uniform(0, RATE_LIMIT_BACKOFF)
+
+async def _gemini_chunks(response: Any) -> AsyncIterator[str]:
+    """Yields the text of a streamed Gemini response."""
+    async for chunk in response:
+        try:
+            text = chunk.text
+        except ValueError:
+            # Chunks without text parts (e.g. finish metadata)
+            continue
+        if text:
+            yield text
+
+async def _openai_chunks(stream: Any) -> AsyncIterator[str]:
+    """Yields the text deltas of a streamed chat completion, closing the connection when done."""
+    try:
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        await stream.close()
+
+class _ReplyRead:
+    """Set by stream_response when it stops reading on purpose (3 messages or [SKIP])."""
+    __slots__ = ("complete",)
+
+    def __init__(self):
+        self.complete = False
+
+def trim_history(chat_history: List[Tuple[str, str]], encoding: Optional["tiktoken.Encoding"] = None, budget: int = HISTORY_TOKEN_BUDGET) -> List[Tuple[str, str]]:
+    """Keeps the newest messages that fit in the token budget (always at least one)."""
+    tokens = 0
+    kept = 0
+    for author, content in reversed(chat_history):
+        line = f"{author}: {content}\n"
+        # Roughly 4 characters per token when the real tokenizer can't be loaded
+        tokens += len(encoding.encode_ordinary(line)) if encoding else len(line) // 4 + 1
+        if tokens > budget and kept:
+            break
+        kept += 1
+    return chat_history[len(chat_history) - kept:]
+
+class SemanticCache:
+    """
+    Embedding-based cache that reuses replies for near-duplicate chat contexts.
+    Entries are partitioned by scope (speaker, participants, mention flag) so
+    context-dependent conversations are never unified.
+    """
+    def __init__(self, threshold: float = SEMANTIC_CACHE_THRESHOLD, ttl: float = SEMANTIC_CACHE_TTL, max_entries: int = SEMANTIC_CACHE_SIZE, max_scopes: int = SEMANTIC_CACHE_MAX_SCOPES):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_scopes = max_scopes
+        # scope -> (unit vectors matrix, timestamps, responses), least recently stored first
+        self._scopes: Dict[Any, Tuple[np.ndarray, List[float], List[List[str]]]] = {}
+
+    def _prune(self, scope: Any):
+        """Drops expired entries from a scope."""
+        matrix, stamps, responses = self._scopes[scope]
+        cutoff = time.monotonic() - self.ttl
+        keep = [i for i, t in enumerate(stamps) if t >= cutoff]
+        if len(keep) == len(stamps):
+            return
+        if not keep:
+            del self._scopes[scope]
+            return
+        self._scopes[scope] = (matrix[keep], [stamps[i] for i in keep], [responses[i] for i in keep])
+
+    def lookup(self, scope: Any, vector: np.ndarray) -> Optional[List[str]]:
+        """Returns the closest cached reply if it is similar enough."""
+        if scope not in self._scopes:
+            return None
+        self._prune(scope)
+        if scope not in self._scopes:
+            return None
+        matrix, _, responses = self._scopes[scope]
+        scores = matrix @ vector
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+        return list(responses[best])
+
+    def store(self, scope: Any, vector: np.ndarray, response: List[str]):
+        """Adds a reply to the scope, dropping the oldest entries when full."""
+        self._evict_expired_scopes()
+        if scope in self._scopes:
+            matrix, stamps, responses = self._scopes.pop(scope)
+            matrix = np.vstack([matrix, vector])
+            stamps = stamps + [time.monotonic()]
+            responses = responses + [list(response)]
+        else:
+            matrix, stamps, responses = vector[np.newaxis, :], [time.monotonic()], [list(response)]
+        if len(stamps) > self.max_entries:
+            matrix, stamps, responses = matrix[-self.max_entries:], stamps[-self.max_entries:], responses[-self.max_entries:]
+        self._scopes[scope] = (matrix, stamps, responses)
+        # Participant sets change constantly, so cap the number of scopes too
+        while len(self._scopes) > self.max_scopes:
+            del self._scopes[next(iter(self._scopes))]
+
+    def _evict_expired_scopes(self):
+        """Drops whole scopes whose newest entry has expired (abandoned conversations)."""
+        cutoff = time.monotonic() - self.ttl
+        for scope in [s for s, (_, stamps, _) in self._scopes.items() if stamps[-1] < cutoff]:
+            del self._scopes[scope]
+
 class KirgBrain:
     """
     Main AI logic for Kirg, supporting multiple providers (OpenRouter, Gemini).
@@ -20,13 +211,19 @@ class KirgBrain:
         
         self.client = None
         self.gemini_model = None
+        self._response_cache: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._throttle = Throttle()
+        self._encoding: Optional["tiktoken.Encoding"] = None
+        self._encoding_lock = asyncio.Lock()
+        self._encoding_retry_at = 0.0
+        self.semantic_cache = SemanticCache() if os.getenv("SEMANTIC_CACHE", "").lower() in ("1", "true", "yes") else None
 
         if self.provider == "gemini" and self.gemini_key:
             genai.configure(api_key=self.gemini_key)
-            self.gemini_model = genai.GenerativeModel("gemini-1.5-flash")
+            self.gemini_model = genai.GenerativeModel(GEMINI_MODEL)
             print(f"[BRAIN] 🧠 Native Gemini Engine Initialized")
         elif self.openrouter_key:
-            self.client = OpenAI(
+            self.client = AsyncOpenAI(
                 base_url="https://openrouter.ai/api/v1",
                 api_key=self.openrouter_key,
                 default_headers={
@@ -38,41 +235,240 @@ class KirgBrain:
         else:
             print(f"[BRAIN] ⚠️ No AI provider configured or keys missing.")
 
-    def _generate_response(self, system_prompt: str, user_prompt: str, temperature: float = 0.7, max_tokens: int = 150) -> Optional[str]:
-        """Internal helper to route requests to the active provider."""
-        try:
-            if self.provider == "gemini" and self.gemini_model:
-                # Gemini handles system instructions in the model initialization or as a specific role
-                # For simplicity and effectiveness, we join them
-                combined_prompt = f"SYSTEM INSTRUCTION: {system_prompt}\n\nUSER INPUT: {user_prompt}"
-                response = self.gemini_model.generate_content(
-                    combined_prompt,
-                    generation_config=genai.types.GenerationConfig(
-                        temperature=temperature,
-                        max_output_tokens=max_tokens,
-                    )
-                )
-                return response.text.strip()
-            
-            elif self.client:
-                completion = self.client.chat.completions.create(
-                    model="xiaomi/mimo-v2-flash:free", 
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_prompt}
-                    ],
-                    temperature=temperature, 
-                    max_tokens=max_tokens,
-                )
-                return completion.choices[0].message.content.strip()
-            
+    def _cache_key(self, model: str, system_prompt: str, user_prompt: str, temperature: float, max_tokens: int) -> str:
+        """Builds a deterministic cache key for a generation request."""
+        payload = {
+            "provider": self.provider,
+            "model": model,
+            "system_prompt": system_prompt,
+            "user_prompt": user_prompt,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+    def _cache_get(self, key: str) -> Optional[str]:
+        """Returns a cached response if present and not expired."""
+        entry = self._response_cache.get(key)
+        if entry is None:
+            return None
+        stored_at, response = entry
+        if time.monotonic() - stored_at > RESPONSE_CACHE_TTL:
+            del self._response_cache[key]
             return None
+        self._response_cache.move_to_end(key)
+        return response
+
+    def _cache_put(self, key: str, response: str):
+        """Stores a response, evicting the least recently used entry when full."""
+        self._response_cache[key] = (time.monotonic(), response)
+        self._response_cache.move_to_end(key)
+        while len(self._response_cache) > RESPONSE_CACHE_SIZE:
+            self._response_cache.popitem(last=False)
+
+    async def _generate_response(self, system_prompt: str, user_prompt: str, temperature: float = 0.7, max_tokens: int = 150) -> Optional[str]:
+        """Internal helper to route requests to the active provider (with response caching)."""
+        model = GEMINI_MODEL if self.provider == "gemini" else OPENROUTER_MODEL
+        cacheable = temperature <= RESPONSE_CACHE_MAX_TEMPERATURE
+        key = self._cache_key(model, system_prompt, user_prompt, temperature, max_tokens) if cacheable else None
+
+        if key:
+            cached = self._cache_get(key)
+            if cached is not None:
+                print(f"[BRAIN] ♻️ Cache hit")
+                return cached
+
+        response = await self._call_provider(model, system_prompt, user_prompt, temperature, max_tokens)
+        if key and response:
+            self._cache_put(key, response)
+        return response
+
+    async def _call_provider(self, model: str, system_prompt: str, user_prompt: str, temperature: float, max_tokens: int) -> Optional[str]:
+        """Sends a single generation request to the active provider."""
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            try:
+                async with self._throttle:
+                    if self.provider == "gemini" and self.gemini_model:
+                        # Gemini handles system instructions in the model initialization or as a specific role
+                        # For simplicity and effectiveness, we join them
+                        combined_prompt = f"SYSTEM INSTRUCTION: {system_prompt}\n\nUSER INPUT: {user_prompt}"
+                        response = await self.gemini_model.generate_content_async(
+                            combined_prompt,
+                            generation_config=genai.types.GenerationConfig(
+                                temperature=temperature,
+                                max_output_tokens=max_tokens,
+                            )
+                        )
+                        return response.text.strip()
+                    
+                    elif self.client:
+                        completion = await self.client.chat.completions.create(
+                            model=model, 
+                            messages=[
+                                {"role": "system", "content": system_prompt},
+                                {"role": "user", "content": user_prompt}
+                            ],
+                            temperature=temperature, 
+                            max_tokens=max_tokens,
+                        )
+                        return completion.choices[0].message.content.strip()
+                
+                return None
+            except Exception as e:
+                if _is_rate_limited(e) and attempt < RATE_LIMIT_RETRIES:
+                    delay = _backoff_delay(attempt)
+                    print(f"[BRAIN] ⏳ Rate limited ({self.provider}), retrying in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+                    continue
+                print(f"[BRAIN] Generation error ({self.provider}): {e}")
+                return None
+
+    async def _stream_response(self, system_prompt: str, user_prompt: str, temperature: float = 0.7, max_tokens: int = 150, read: Optional[_ReplyRead] = None) -> AsyncIterator[str]:
+        """Streaming counterpart of _generate_response; yields raw text chunks (shares the response cache)."""
+        model = GEMINI_MODEL if self.provider == "gemini" else OPENROUTER_MODEL
+        cacheable = temperature <= RESPONSE_CACHE_MAX_TEMPERATURE
+        key = self._cache_key(model, system_prompt, user_prompt, temperature, max_tokens) if cacheable else None
+
+        if key:
+            cached = self._cache_get(key)
+            if cached is not None:
+                print(f"[BRAIN] ♻️ Cache hit")
+                yield cached
+                return
+
+        chunks = []
+        finished = False
+        try:
+            async with aclosing(self._stream_provider(model, system_prompt, user_prompt, temperature, max_tokens)) as stream:
+                async for chunk in stream:
+                    chunks.append(chunk)
+                    yield chunk
+            finished = True
+        finally:
+            # A prefix is only reusable if the reply reader itself chose to stop there;
+            # a send failure or cancellation closes the stream the same way
+            response = "".join(chunks).strip()
+            if key and response and (finished or (read and read.complete)):
+                self._cache_put(key, response)
+
+    async def _stream_provider(self, model: str, system_prompt: str, user_prompt: str, temperature: float, max_tokens: int) -> AsyncIterator[str]:
+        """Streams a single generation request, retrying 429s raised while opening it."""
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            try:
+                # The throttle only covers opening the request; the caller reads the
+                # stream at typing speed and must not hold a slot meanwhile
+                async with self._throttle:
+                    stream = await self._open_stream(model, system_prompt, user_prompt, temperature, max_tokens)
+                break
+            except Exception as e:
+                if not _is_rate_limited(e) or attempt == RATE_LIMIT_RETRIES:
+                    raise
+                delay = _backoff_delay(attempt)
+                print(f"[BRAIN] ⏳ Rate limited ({self.provider}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+        if stream is None:
+            return
+        async with aclosing(stream):
+            async for chunk in stream:
+                yield chunk
+
+    async def _open_stream(self, model: str, system_prompt: str, user_prompt: str, temperature: float, max_tokens: int) -> Optional[AsyncIterator[str]]:
+        """Opens a streaming request on the active provider and returns its raw text chunks."""
+        if self.provider == "gemini" and self.gemini_model:
+            combined_prompt = f"SYSTEM INSTRUCTION: {system_prompt}\n\nUSER INPUT: {user_prompt}"
+            response = await self.gemini_model.generate_content_async(
+                combined_prompt,
+                generation_config=genai.types.GenerationConfig(
+                    temperature=temperature,
+                    max_output_tokens=max_tokens,
+                ),
+                stream=True
+            )
+            return _gemini_chunks(response)
+
+        elif self.client:
+            stream = await self.client.chat.completions.create(
+                model=model, 
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt}
+                ],
+                temperature=temperature, 
+                max_tokens=max_tokens,
+                stream=True,
+            )
+            return _openai_chunks(stream)
+
+        return None
+
+    async def _stream_lines(self, system_prompt: str, user_prompt: str, temperature: float = 0.7, max_tokens: int = 150, read: Optional[_ReplyRead] = None) -> AsyncIterator[str]:
+        """Yields complete response lines as soon as they arrive, with thinking blocks removed."""
+        buffer = ""
+        try:
+            async with aclosing(self._stream_response(system_prompt, user_prompt, temperature, max_tokens, read)) as chunks:
+                async for chunk in chunks:
+                    buffer = _THINK_RE.sub('', buffer + chunk)
+                    # Hold everything back while a thinking block is still open
+                    if _THINK_OPEN_RE.search(buffer):
+                        continue
+                    *complete, buffer = buffer.split('\n')
+                    for line in complete:
+                        yield line
         except Exception as e:
+            # The generation broke off; whatever is left in the buffer is a cut-off line
             print(f"[BRAIN] Generation error ({self.provider}): {e}")
+            return
+
+        unclosed = _THINK_OPEN_RE.search(buffer)
+        if unclosed:
+            buffer = buffer[:unclosed.start()]
+        for line in buffer.split('\n'):
+            yield line
+
+    async def _get_encoding(self) -> Optional["tiktoken.Encoding"]:
+        """Loads the tokenizer off the event loop on first use; failed loads are retried later."""
+        if self._encoding is not None or time.monotonic() < self._encoding_retry_at:
+            return self._encoding
+        async with self._encoding_lock:
+            if self._encoding is None and time.monotonic() >= self._encoding_retry_at:
+                try:
+                    # First load downloads the BPE file with a blocking request
+                    self._encoding = await asyncio.wait_for(
+                        asyncio.to_thread(tiktoken.get_encoding, "cl100k_base"),
+                        TOKENIZER_LOAD_TIMEOUT
+                    )
+                except Exception as e:
+                    self._encoding_retry_at = time.monotonic() + TOKENIZER_RETRY_DELAY
+                    print(f"[BRAIN] ⚠️ Tokenizer unavailable, estimating token counts: {e!r}")
+        return self._encoding
+
+    async def _embed(self, text: str) -> Optional[np.ndarray]:
+        """Returns a unit-length embedding for the text using the active provider."""
+        try:
+            async with self._throttle:
+                if self.provider == "gemini" and self.gemini_model:
+                    result = await genai.embed_content_async(model=GEMINI_EMBEDDING_MODEL, content=text)
+                    vector = np.asarray(result["embedding"], dtype=np.float32)
+                elif self.client:
+                    result = await self.client.embeddings.create(model=OPENROUTER_EMBEDDING_MODEL, input=text)
+                    vector = np.asarray(result.data[0].embedding, dtype=np.float32)
+                else:
+                    return None
+        except Exception as e:
+            print(f"[BRAIN] Embedding error ({self.provider}): {e}")
             return None
 
-    def decide_and_respond(self, chat_history: List[Tuple[str, str]], my_name: str, is_direct: bool = False) -> Optional[List[str]]:
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    async def decide_and_respond(self, chat_history: List[Tuple[str, str]], my_name: str, is_direct: bool = False) -> Optional[List[str]]:
         """Analyzes chat history and decides whether and how to respond."""
+        messages = [msg async for msg in self.stream_response(chat_history, my_name, is_direct)]
+        return messages or None
+
+    async def stream_response(self, chat_history: List[Tuple[str, str]], my_name: str, is_direct: bool = False) -> AsyncIterator[str]:
+        """Like decide_and_respond, but yields each message as soon as the model finishes its line."""
         
         system_prompt = (
             f"You are {my_name}, a 17-year-old Discord native. You're a bit of a shut-in, gamer, and tech enthusiast.\n"
@@ -92,13 +488,40 @@ class KirgBrain:
         if is_direct:
             system_prompt += "\nIMPORTANT: You were mentioned. DO NOT [SKIP], respond now."
         
-        history_text = ""
+        chat_history = trim_history(chat_history, await self._get_encoding())
+
+        # Single pass over the history builds the prompt text, participants and echo filter
+        history_parts = []
+        active_users = [] # In order of first appearance
+        active_lower = set()
         recent_contents = set()
-        active_users = set()
+        append = history_parts.append
+        add_content = recent_contents.add
         for author, content in chat_history:
-            history_text += f"{author}: {content}\n"
-            active_users.add(author)
-            recent_contents.add(content.lower().strip())
+            append(f"{author}: {content}\n")
+            author_lc = author.casefold()
+            if author_lc not in active_lower:
+                active_lower.add(author_lc)
+                active_users.append(author)
+            add_content(content.casefold().strip())
+        history_text = "".join(history_parts)
+        my_lower = my_name.casefold()
+
+        # Semantic cache lookup on the most recent lines
+        cache_scope = (my_name, is_direct, frozenset(active_users))
+        cache_vector = None
+        if self.semantic_cache and chat_history:
+            window = "\n".join(f"{author}: {content}" for author, content in chat_history[-SEMANTIC_CACHE_WINDOW:])
+            cache_vector = await self._embed(window)
+            if cache_vector is not None:
+                cached = self.semantic_cache.lookup(cache_scope, cache_vector)
+                # Never replay lines that are already in the chat
+                cached = [m for m in cached or [] if m.casefold().strip() not in recent_contents]
+                if cached:
+                    print(f"[BRAIN] ♻️ Semantic cache hit")
+                    for msg in cached:
+                        yield msg
+                    return
 
         active_list = ", ".join(active_users)
         user_prompt = (
@@ -107,60 +530,62 @@ class KirgBrain:
             f"Respond as {my_name}. Send ONLY your response, no names prefixing."
         )
 
-        response = self._generate_response(system_prompt, user_prompt)
-        
-        if not response:
-            return None
-
-        # Clean up thinking tags and formatting
-        response = re.sub(r'<(think|thought)>.*?</\1>', '', response, flags=re.DOTALL | re.IGNORECASE).strip()
-        
-        if "[SKIP]" in response:
-            return None
-        
-        lines = response.split('\n')
         valid_msgs = []
+        valid_lower = set()
         common_slang = {"intankavel", "slk", "fds", "mid", "peak"}
 
-        for line in lines:
-            line = line.strip()
-            if not line or "[SKIP]" in line: continue 
+        read = _ReplyRead()
+        async with aclosing(self._stream_lines(system_prompt, user_prompt, read=read)) as lines:
+            async for line in lines:
+                line = line.strip()
+                # Lines already sent can't be taken back, so [SKIP] just ends the reply
+                if "[SKIP]" in line:
+                    read.complete = True
+                    break
+                if not line: continue 
             
-            # Filter hallucinated history
-            if ":" in line:
-                parts = line.split(":", 1)
-                name_part = parts[0].strip().lower()
-                if name_part in [u.lower() for u in active_users] or name_part == my_name.lower():
-                    if name_part == my_name.lower():
-                        line = parts[1].strip()
-                    else:
-                        continue
+                # Filter hallucinated history
+                if ":" in line:
+                    parts = line.split(":", 1)
+                    name_part = parts[0].strip().casefold()
+                    if name_part in active_lower or name_part == my_lower:
+                        if name_part == my_lower:
+                            line = parts[1].strip()
+                        else:
+                            continue
 
-            # Filter eco
-            if line.lower().strip() in recent_contents:
-                continue
-
-            # Deduplicate slang
-            words = line.split()
-            clean_words = []
-            seen_slang = set()
-            for w in words:
-                wc = w.lower().replace('.', '').replace(',', '')
-                if wc in common_slang:
-                    if wc in seen_slang: continue
-                    seen_slang.add(wc)
-                clean_words.append(w)
+                # Filter eco
+                if line.casefold().strip() in recent_contents:
+                    continue
+
+                # Deduplicate slang
+                words = line.split()
+                clean_words = []
+                seen_slang = set()
+                for w in words:
+                    wc = w.translate(_PUNCT_STRIP).lower()
+                    if wc in common_slang:
+                        if wc in seen_slang: continue
+                        seen_slang.add(wc)
+                    clean_words.append(w)
             
-            line_clean = " ".join(clean_words).replace('"', '').replace("'", "")
+                line_clean = " ".join(clean_words).replace('"', '').replace("'", "")
             
-            if line_clean:
-                if any(line_clean.lower() == v.lower() for v in valid_msgs):
-                    continue
-                valid_msgs.append(line_clean)
+                if line_clean:
+                    clean_lower = line_clean.lower()
+                    if clean_lower in valid_lower:
+                        continue
+                    valid_lower.add(clean_lower)
+                    valid_msgs.append(line_clean)
+                    yield line_clean
+                    if len(valid_msgs) == 3:
+                        read.complete = True
+                        break
 
-        return valid_msgs[:3] if valid_msgs else None
+        if valid_msgs and cache_vector is not None:
+            self.semantic_cache.store(cache_scope, cache_vector, valid_msgs)
 
-    def decide_proactive_message(self, chat_history: List[Tuple[str, str]], my_name: str) -> Optional[List[str]]:
+    async def decide_proactive_message(self, chat_history: List[Tuple[str, str]], my_name: str) -> Optional[List[str]]:
         """Generates a proactive message to break the silence in the chat."""
         
         system_prompt = (
@@ -171,19 +596,17 @@ class KirgBrain:
             "RULES: NO greetings, speak directly, max 10 words."
         )
 
-        history_text = ""
-        for author, content in chat_history[-5:]:
-            history_text += f"{author}: {content}\n"
+        history_text = "".join(f"{author}: {content}\n" for author, content in chat_history[-5:])
 
         user_prompt = (
             f"RECENT CHAT:\n{history_text}\n---\n"
             f"What would {my_name} say right now?"
         )
 
-        response = self._generate_response(system_prompt, user_prompt, temperature=0.9, max_tokens=60)
+        response = await self._generate_response(system_prompt, user_prompt, temperature=0.9, max_tokens=60)
         
         if not response or "[SKIP]" in response:
              return ["slk que tédio"]
              
-        response = re.sub(r'<(think|thought)>.*?</\1>', '', response, flags=re.DOTALL | re.IGNORECASE).strip()
+        response = _THINK_RE.sub('', response).strip()
         return [response.replace('"', '').replace("'", "").lower()]
@@ -2,11 +2,13 @@ import discord
 import os
 import asyncio
 import random
-import json
+import orjson
 import time
-import re
-from collections import deque
-from typing import Dict, Any, Optional
+import ahocorasick
+from collections import defaultdict, deque
+from contextlib import AsyncExitStack, aclosing
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, Any, List, Optional, Set
 from dotenv import load_dotenv
 from brain import KirgBrain
 
@@ -15,18 +17,32 @@ HISTORY_LIMIT = 12
 TYPING_SPEED_RANGE = (0.04, 0.12)
 PROACTIVITY_RANGE_MINUTES = (15, 50)
 DEMO_PROACTIVITY_RANGE_MINUTES = (5, 20)
+CONFIG_SAVE_DELAY = 5.0
+
+@dataclass(slots=True)
+class ChannelState:
+    """Per-channel (or per-DM) conversation state."""
+    memory: deque = field(default_factory=lambda: deque(maxlen=HISTORY_LIMIT))
+    pending: Optional[asyncio.Task] = None # Debounced reply still in its reading delay
+    mention_pending: bool = False
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
 
 def load_config() -> Dict[str, Any]:
     """Loads configuration from config.json or returns default values."""
     if not os.path.exists("config.json"):
         return {"channels": {}, "last_channel": ""}
-    with open("config.json", "r") as f:
-        return json.load(f)
+    with open("config.json", "rb") as f:
+        return orjson.loads(f.read())
 
 def save_config(config: Dict[str, Any]):
     """Saves the current configuration to config.json."""
-    with open("config.json", "w") as f:
-        json.dump(config, f, indent=4)
+    with open("config.json", "wb") as f:
+        f.write(orjson.dumps(config, option=orjson.OPT_INDENT_2))
+
+async def iter_lines(lines: List[str]) -> AsyncIterator[str]:
+    """Adapts a ready-made list of messages to the streamed reply interface."""
+    for line in lines:
+        yield line
 
 load_dotenv()
 TOKEN = os.getenv("KIRG_TOKEN")
@@ -42,12 +58,17 @@ class KirgClient(discord.Client):
         self.brain = KirgBrain() # Automatically picks provider from .env
         self.config = load_config()
         self.target_channel_id = None
-        self.chat_memories = {} 
+        self.channels: Dict[Any, ChannelState] = defaultdict(ChannelState)
         self.me_user = None
-        self.processing_lock = asyncio.Lock()
-        self.known_users = {} # Cache for mention mapping
-        self.channel_debounces = {}
-        self.channel_mentions_pending = {}
+        self.known_users = {} # Cache for mention mapping (persisted in config.json)
+        self._mention_automaton = ahocorasick.Automaton() # Matches every known name in one pass
+        self._mention_automaton_dirty = False
+        self._config_save_handle: Optional[asyncio.TimerHandle] = None
+        self._reply_tasks: Set[asyncio.Task] = set() # Strong refs to debounced replies until they finish
+        # Older configs used .lower() keys; fold them so the persisted map doesn't collect duplicates
+        self.config["known_users"] = {name.casefold(): mention for name, mention in self.config.get("known_users", {}).items()}
+        for name, mention in self.config["known_users"].items():
+            self._add_known_user(name, mention)
         
         # Proactivity tracking
         self.last_activity_time = time.time()
@@ -74,29 +95,27 @@ class KirgClient(discord.Client):
             now = time.time()
             if now > self.next_activity_trigger:
                 # Trigger logic
-                if self.target_channel_id in self.chat_memories:
-                    history = self.chat_memories[self.target_channel_id]
-                    if history:
-                        last_author, _ = history[-1]
-                        my_name = self.me_user.display_name if self.me_user else "Ian"
-                        # Don't talk twice in a row if yours was the last message
-                        if last_author == my_name:
-                            self._schedule_next_proactivity()
-                            continue
+                state = self.channels[self.target_channel_id]
+                if state.memory:
+                    last_author, _ = state.memory[-1]
+                    my_name = self.me_user.display_name if self.me_user else "Ian"
+                    # Don't talk twice in a row if yours was the last message
+                    if last_author == my_name:
+                        self._schedule_next_proactivity()
+                        continue
                 
-                if not self.processing_lock.locked():
-                    async with self.processing_lock:
+                if not state.lock.locked():
+                    async with state.lock:
                         print("⚡ Boredom trigger activated!")
                         channel = self.get_channel(self.target_channel_id)
                         if channel:
-                            history_list = list(self.chat_memories.get(self.target_channel_id, []))
+                            history_list = list(state.memory)
                             my_nick = self.me_user.display_name
                             
-                            response = await asyncio.to_thread(self.brain.decide_proactive_message, history_list, my_nick)
+                            response = await self.brain.decide_proactive_message(history_list, my_nick)
                             
                             if response:
-                                async with channel.typing():
-                                    await self._send_response_package(channel, response, my_nick, self.target_channel_id)
+                                await self._send_response_package(channel, iter_lines(response), my_nick, self.target_channel_id)
                 
                 self._schedule_next_proactivity()
 
@@ -104,15 +123,49 @@ class KirgClient(discord.Client):
         """Maps user names/nicks to mentions for future AI use."""
         if not user or user.bot: return
         
-        keys = [user.name.lower()]
-        if user.display_name and user.display_name.lower() != user.name.lower():
-            keys.append(user.display_name.lower())
-        
-        if hasattr(user, 'nick') and user.nick and user.nick.lower() not in keys:
-            keys.append(user.nick.lower())
+        # Members always have .nick (possibly None); plain Users have no nick at all
+        keys = {user.name.casefold()}
+        display = getattr(user, 'display_name', None)
+        if display:
+            keys.add(display.casefold())
+        nick = getattr(user, 'nick', None)
+        if nick:
+            keys.add(nick.casefold())
         
+        mention = user.mention
+        changed = False
         for k in keys:
-            self.known_users[k] = user.mention
+            if self.known_users.get(k) != mention:
+                self._add_known_user(k, mention)
+                self.config.setdefault("known_users", {})[k] = mention
+                changed = True
+
+        if changed:
+            self._schedule_config_save()
+
+    def _add_known_user(self, name: str, mention: str):
+        """Registers a name -> mention pair in the lookup table and automaton."""
+        if name not in self.known_users:
+            self._mention_automaton.add_word(name, name)
+            self._mention_automaton_dirty = True
+        self.known_users[name] = mention
+
+    def _schedule_config_save(self):
+        """Debounces config writes so bursts of new users hit the disk once."""
+        if self._config_save_handle is None:
+            self._config_save_handle = asyncio.get_running_loop().call_later(CONFIG_SAVE_DELAY, self._flush_config)
+
+    def _flush_config(self):
+        """Writes pending config changes to disk."""
+        self._config_save_handle = None
+        save_config(self.config)
+
+    async def close(self):
+        """Flushes pending config changes before shutting down."""
+        if self._config_save_handle is not None:
+            self._config_save_handle.cancel()
+            self._flush_config()
+        await super().close()
 
     async def on_ready(self):
         """Called when the client is logged in and ready."""
@@ -128,15 +181,36 @@ class KirgClient(discord.Client):
 
     def _format_mentions(self, text: str) -> str:
         """Replaces plain text names with Discord mentions."""
-        if not text: return text
-        sorted_names = sorted(self.known_users.keys(), key=len, reverse=True)
-        
-        for name in sorted_names:
-            if name in text.lower():
-                mention = self.known_users[name]
-                pattern = re.compile(re.escape(name), re.IGNORECASE)
-                text = pattern.sub(mention, text)
-        return text
+        if not text or not self.known_users: return text
+        if self._mention_automaton_dirty:
+            self._mention_automaton.make_automaton()
+            self._mention_automaton_dirty = False
+
+        folded = text.casefold()
+        offsets = None
+        if len(folded) != len(text):
+            # Some characters expand when casefolded (e.g. ß -> ss); map folded offsets back to the original
+            offsets = [i for i, c in enumerate(text) for _ in c.casefold()]
+
+        hits = []
+        for end, name in self._mention_automaton.iter(folded):
+            start = end - len(name) + 1
+            if offsets:
+                start, end = offsets[start], offsets[end]
+            hits.append((start, end + 1, name))
+
+        # Leftmost-longest, non-overlapping matches
+        hits.sort(key=lambda hit: (hit[0], -hit[1]))
+        parts = []
+        pos = 0
+        for start, end, name in hits:
+            if start < pos:
+                continue
+            parts.append(text[pos:start])
+            parts.append(self.known_users[name])
+            pos = end
+        parts.append(text[pos:])
+        return "".join(parts)
 
     async def setup_channel(self):
         """Prompts user to select the simulation channel."""
@@ -184,11 +258,11 @@ class KirgClient(discord.Client):
             print(f"📚 Preloading history for {channel}...")
             
             history = [msg async for msg in channel.history(limit=HISTORY_LIMIT)]
-            self.chat_memories[channel_id] = deque(maxlen=HISTORY_LIMIT)
-            
-            for msg in reversed(history):
-                real_name = await self.get_real_name(msg.author, guild)
-                self.chat_memories[channel_id].append((real_name, msg.content))
+            history.reverse()
+            names = await asyncio.gather(*(self.get_real_name(msg.author, guild) for msg in history))
+            memory = self.channels[channel_id].memory
+            memory.clear()
+            memory.extend((name, msg.content) for name, msg in zip(names, history))
             
             print(f"🧠 Context loaded! ({len(self.known_users)} users mapped)")
         except Exception as e:
@@ -206,18 +280,16 @@ class KirgClient(discord.Client):
         
         if message.channel.id != self.target_channel_id:
             return
-            
-        if self.processing_lock.locked():
+
+        state = self.channels[message.channel.id]
+        if state.lock.locked():
             return
 
         self._remember_user(message.author)
         clean_content = message.content.replace(f"<@{self.user.id}>", "@Me")
         
-        if message.channel.id not in self.chat_memories:
-            self.chat_memories[message.channel.id] = deque(maxlen=HISTORY_LIMIT)
-        
         real_name = await self.get_real_name(message.author, message.guild)
-        self.chat_memories[message.channel.id].append((real_name, clean_content))
+        state.memory.append((real_name, clean_content))
 
         # Reset proactivity timer
         self.last_activity_time = time.time()
@@ -227,75 +299,88 @@ class KirgClient(discord.Client):
         is_direct = self.user.mentioned_in(message) or (message.reference and message.reference.cached_message and message.reference.cached_message.author.id == self.user.id)
         
         if is_direct:
-            self.channel_mentions_pending[message.channel.id] = True
-
-        this_msg_time = time.time()
-        self.channel_debounces[message.channel.id] = this_msg_time
+            state.mention_pending = True
 
-        # Reading delay simulation
+        # Only the latest message of a burst gets to finish its reading delay
+        if state.pending:
+            state.pending.cancel()
         wait_time = random.uniform(2.0, 4.5)
-        await asyncio.sleep(wait_time)
+        task = asyncio.create_task(self._delayed_respond(message, state, wait_time))
+        self._reply_tasks.add(task)
+        task.add_done_callback(self._on_reply_done)
+        state.pending = task
 
-        if self.channel_debounces.get(message.channel.id) != this_msg_time:
+    def _on_reply_done(self, task: asyncio.Task):
+        """Drops the finished reply task and reports its failure, if any."""
+        self._reply_tasks.discard(task)
+        if task.cancelled():
             return
+        error = task.exception()
+        if error is not None:
+            print(f"Reply failed: {error!r}")
+
+    async def _delayed_respond(self, message: discord.Message, state: ChannelState, wait_time: float):
+        """Waits the simulated reading delay, then replies to the batched messages."""
+        await asyncio.sleep(wait_time)
+        # Past this point a newer message must not cancel us
+        state.pending = None
 
-        if self.processing_lock.locked():
+        if state.lock.locked():
             return
 
-        async with self.processing_lock:
-            mention_was_pending = self.channel_mentions_pending.get(message.channel.id, False)
-            self.channel_mentions_pending[message.channel.id] = False
+        async with state.lock:
+            mention_was_pending = state.mention_pending
+            state.mention_pending = False
             
-            history_list = list(self.chat_memories.get(message.channel.id, []))
+            history_list = list(state.memory)
             my_nickname = message.guild.me.display_name
             
-            response = await asyncio.to_thread(self.brain.decide_and_respond, history_list, my_nickname, mention_was_pending)
-
-            if response:
-                async with message.channel.typing():
-                    await self._send_response_package(message.channel, response, my_nickname, message.channel.id, message if mention_was_pending else None)
+            response = self.brain.stream_response(history_list, my_nickname, mention_was_pending)
+            await self._send_response_package(message.channel, response, my_nickname, message.channel.id, message if mention_was_pending else None)
 
     async def _handle_dm(self, message: discord.Message):
         """Handles response logic for Direct Messages."""
-        async with self.processing_lock:
-            dm_key = f"dm_{message.author.id}"
-            if dm_key not in self.chat_memories:
-                self.chat_memories[dm_key] = deque(maxlen=HISTORY_LIMIT)
-            
-            self.chat_memories[dm_key].append((message.author.name, message.content))
+        dm_key = f"dm_{message.author.id}"
+        state = self.channels[dm_key]
+        async with state.lock:
+            state.memory.append((message.author.name, message.content))
             await asyncio.sleep(random.uniform(0.5, 2.0))
             
-            history_list = list(self.chat_memories[dm_key])
-            response = await asyncio.to_thread(self.brain.decide_and_respond, history_list, "Ian", True)
-            
-            if response:
-                async with message.channel.typing():
-                    await self._send_response_package(message.channel, response, "Ian", dm_key, message)
-
-    async def _send_response_package(self, channel: Any, response_list: List[str], my_name: str, memory_id: Any, reply_to: Optional[discord.Message] = None):
-        """Sequentially sends a package of messages with typing delays."""
-        for i, line in enumerate(response_list):
-            formatted_line = self._format_mentions(line)
-            
-            # Simulated typing speed based on length
-            speed = random.uniform(*TYPING_SPEED_RANGE)
-            duration = min(len(line) * speed, 8.0)
-            await asyncio.sleep(duration)
-
-            try:
-                if i == 0 and reply_to:
-                    await reply_to.reply(formatted_line, mention_author=True)
+            history_list = list(state.memory)
+            response = self.brain.stream_response(history_list, "Ian", True)
+            await self._send_response_package(message.channel, response, "Ian", dm_key, message)
+
+    async def _send_response_package(self, channel: Any, responses: AsyncIterator[str], my_name: str, memory_id: Any, reply_to: Optional[discord.Message] = None):
+        """Sends messages with typing delays as soon as each one is generated."""
+        memory = self.channels[memory_id].memory
+        started = False
+        async with aclosing(responses), AsyncExitStack() as typing:
+            async for line in responses:
+                if started:
+                    # Small pause between consecutive messages
+                    await asyncio.sleep(random.uniform(1.0, 2.5))
                 else:
-                    await channel.send(formatted_line)
-                
-                self.chat_memories[memory_id].append((my_name, line))
-                print(f"🗣️ Sent: {line}")
+                    # Only show typing once there is something to say
+                    await typing.enter_async_context(channel.typing())
+
+                formatted_line = self._format_mentions(line)
                 
-                # Small pause between consecutive messages
-                if i < len(response_list) - 1:
-                    await asyncio.sleep(random.uniform(1.0, 2.5))
-            except Exception as e:
-                print(f"Failed to send message: {e}")
+                # Simulated typing speed based on length
+                speed = random.uniform(*TYPING_SPEED_RANGE)
+                duration = min(len(line) * speed, 8.0)
+                await asyncio.sleep(duration)
+
+                try:
+                    if not started and reply_to:
+                        await reply_to.reply(formatted_line, mention_author=True)
+                    else:
+                        await channel.send(formatted_line)
+                    
+                    memory.append((my_name, line))
+                    print(f"🗣️ Sent: {line}")
+                except Exception as e:
+                    print(f"Failed to send message: {e}")
+                started = True
 
 if __name__ == "__main__":
     if TOKEN: